@@ -1,10 +1,10 @@
 # app/routes.py
 from flask import (
     Blueprint,
+    after_this_request,
     render_template,
     request,
     current_app,
-    jsonify,
     Response,
     stream_with_context,
     send_file,
@@ -13,35 +13,145 @@ from werkzeug.utils import secure_filename
 from pathlib import Path
 from datetime import datetime
 from uuid import uuid4
-from queue import Queue, Empty
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock, Event
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from time import monotonic
 import gc
+import os
+import shutil
+
+import orjson
 
 from .services.mdb_export_stream import export_mdb_to_csv_stream
 
 bp = Blueprint("main", __name__)
 ALLOWED_EXTENSIONS = {".mdb"}
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB por write() al guardar el .mdb
 
 
 def allowed_file(filename: str) -> bool:
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
 
+def ojsonify(obj) -> Response:
+    # como flask.jsonify, pero serializado con orjson (extensión C)
+    return Response(orjson.dumps(obj), mimetype="application/json")
+
+
+def save_upload(file, dst_path: Path, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    # FileStorage.save copia en bloques de 16 KiB; con .mdb de varios MB son miles de write()
+    with open(dst_path, "wb") as dst:
+        shutil.copyfileobj(file.stream, dst, length=chunk_size)
+
+
 @bp.route("/")
 def home():
     return render_template("index.html", title="Home")
 
 
 # --- Infra simple en memoria para SSE ---
-EVENT_QUEUES = {}  # task_id -> Queue[str]
-TASK_OUTPUTS = {}  # task_id -> Path
-TASK_ERRORS = {}  # task_id -> str
+_MISSING = object()
+
+
+class TTLCache:
+    """Dict en memoria acotado: LRU con `maxsize` entradas que expiran a los `ttl` segundos."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expira_en, valor)
+        self._lock = Lock()
+
+    def _expire(self, now: float):
+        for key in [k for k, (exp, _) in self._data.items() if exp <= now]:
+            del self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            now = monotonic()
+            self._expire(now)
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            exp, value = item
+            if exp <= monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            _, value = self._data.pop(key, (None, default))
+            return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(monotonic())
+            return len(self._data)
+
+
+EVENT_QUEUES = TTLCache(maxsize=1024, ttl=3600)  # task_id -> (deque[str], Event)
+TASK_OUTPUTS = TTLCache(maxsize=1024, ttl=3600)  # task_id -> Path
+TASK_ERRORS = TTLCache(maxsize=1024, ttl=3600)  # task_id -> str
+
+
+# Pool compartido para las conversiones: hilos acotados y reutilizados entre uploads
+EXPORT_WORKERS = os.cpu_count() or 4
+MAX_PENDING_EXPORTS = EXPORT_WORKERS * 4
+EXECUTOR = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="mdb")
+# un cupo por export en curso o en cola; sin cupo -> 429
+EXPORT_SLOTS = BoundedSemaphore(EXPORT_WORKERS + MAX_PENDING_EXPORTS)
+
+
+# GC cíclico pausado mientras haya al menos un export corriendo (contador entre hilos)
+_GC_LOCK = Lock()
+_GC_PAUSES = 0
+_GC_WAS_ENABLED = True
+
+
+@contextmanager
+def gc_paused():
+    global _GC_PAUSES, _GC_WAS_ENABLED
+    with _GC_LOCK:
+        if _GC_PAUSES == 0:
+            _GC_WAS_ENABLED = gc.isenabled()
+            gc.disable()
+        _GC_PAUSES += 1
+    try:
+        yield
+    finally:
+        with _GC_LOCK:
+            _GC_PAUSES -= 1
+            if _GC_PAUSES == 0 and _GC_WAS_ENABLED:
+                gc.enable()
+
+
+def _forget(task_id: str):
+    EVENT_QUEUES.pop(task_id)
+    TASK_OUTPUTS.pop(task_id)
+    TASK_ERRORS.pop(task_id)
 
 
 def _emit(task_id: str, msg: str):
-    q = EVENT_QUEUES.get(task_id)
-    if q:
-        q.put(msg)
+    channel = EVENT_QUEUES.get(task_id)
+    if channel:
+        # deque.append es atómico en CPython; el Event solo despierta al consumidor
+        dq, ev = channel
+        dq.append(msg)
+        ev.set()
 
 
 @bp.get("/upload", endpoint="upload")
@@ -66,7 +176,7 @@ def upload_post():
     file = request.files.get("file")
     if not file or file.filename == "" or not allowed_file(file.filename):
         return (
-            jsonify({"ok": False, "error": "Debes subir un archivo .mdb válido"}),
+            ojsonify({"ok": False, "error": "Debes subir un archivo .mdb válido"}),
             400,
         )
 
@@ -74,46 +184,56 @@ def upload_post():
         sel_year = int(request.form.get("year", now.year))
         sel_month = int(request.form.get("month", now.month))
         if sel_year == now.year and sel_month > now.month:
-            return jsonify({"ok": False, "error": "Mes futuro no permitido"}), 400
+            return ojsonify({"ok": False, "error": "Mes futuro no permitido"}), 400
         if not (1 <= sel_month <= 12):
             raise ValueError
     except Exception:
-        return jsonify({"ok": False, "error": "Año/Mes inválidos"}), 400
+        return ojsonify({"ok": False, "error": "Año/Mes inválidos"}), 400
 
-    upload_dir = Path(current_app.config.get("UPLOAD_FOLDER", "/tmp/uploads"))
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    if not EXPORT_SLOTS.acquire(blocking=False):
+        return (
+            ojsonify({"ok": False, "error": "Servidor ocupado, intenta más tarde"}),
+            429,
+        )
 
+    upload_dir = Path(current_app.config.get("UPLOAD_FOLDER", "/tmp/uploads"))
     safe_name = secure_filename(file.filename)
     mdb_path = upload_dir / safe_name
-    file.save(mdb_path)
+    try:
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        save_upload(file, mdb_path)
+    except Exception:
+        EXPORT_SLOTS.release()
+        raise
 
     ts = datetime.now().strftime("%Y%m%d-%H%M%S")
     xlsx_name = f"{mdb_path.stem}_inout_{sel_year:04d}-{sel_month:02d}_{ts}.xlsx"
     xlsx_path = upload_dir / xlsx_name
 
     task_id = str(uuid4())
-    q = Queue()
-    EVENT_QUEUES[task_id] = q
+    EVENT_QUEUES[task_id] = (deque(), Event())
 
     def worker():
         try:
             _emit(task_id, f"Archivo recibido: {safe_name}")
             _emit(task_id, f"Procesando (año={sel_year}, mes={sel_month})…")
-            export_mdb_to_csv_stream(
-                mdb_path, xlsx_path, year=sel_year, month=sel_month
-            )
+            # el export crea millones de objetos sin ciclos: el refcount los libera solo
+            with gc_paused():
+                export_mdb_to_csv_stream(
+                    mdb_path, xlsx_path, year=sel_year, month=sel_month
+                )
             TASK_OUTPUTS[task_id] = xlsx_path
             _emit(task_id, "DONE")
         except Exception as e:
             TASK_ERRORS[task_id] = str(e)
             _emit(task_id, f"ERROR: {e}")
         finally:
-            gc.collect()
+            EXPORT_SLOTS.release()
 
-    Thread(target=worker, daemon=True).start()
+    EXECUTOR.submit(worker)
 
     return (
-        jsonify(
+        ojsonify(
             {
                 "ok": True,
                 "task_id": task_id,
@@ -127,27 +247,31 @@ def upload_post():
 
 @bp.get("/events/<task_id>")
 def events(task_id: str):
-    q = EVENT_QUEUES.get(task_id)
-    if q is None:
+    channel = EVENT_QUEUES.get(task_id)
+    if channel is None:
         return Response(
             "event: error\ndata: Tarea no encontrada\n\n", mimetype="text/event-stream"
         )
 
     @stream_with_context
     def gen():
+        dq, ev = channel
         yield "event: ping\ndata: ready\n\n"
         while True:
-            try:
-                msg = q.get(timeout=25)
+            while dq:
+                msg = dq.popleft()
                 if msg == "DONE":
                     yield "event: done\ndata: done\n\n"
-                    break
+                    return
                 elif msg.startswith("ERROR:"):
                     yield f"event: error\ndata: {msg}\n\n"
-                    break
+                    return
                 else:
                     yield f"event: message\ndata: {msg}\n\n"
-            except Empty:
+            # limpiar antes de volver a vaciar la cola: no se pierde ningún set()
+            if ev.wait(timeout=25):
+                ev.clear()
+            else:
                 yield "event: ping\ndata: keep-alive\n\n"
 
     return Response(gen(), mimetype="text/event-stream")
@@ -155,11 +279,21 @@ def events(task_id: str):
 
 @bp.get("/download/<task_id>")
 def download(task_id: str):
-    if task_id in TASK_ERRORS:
-        return jsonify({"ok": False, "error": TASK_ERRORS[task_id]}), 400
+    error = TASK_ERRORS.get(task_id)
+    if error is not None:
+        _forget(task_id)
+        return ojsonify({"ok": False, "error": error}), 400
     path = TASK_OUTPUTS.get(task_id)
     if not path or not Path(path).exists():
-        return jsonify({"ok": False, "error": "Archivo no disponible"}), 404
+        return ojsonify({"ok": False, "error": "Archivo no disponible"}), 404
+
+    @after_this_request
+    def cleanup(response):
+        # send_file ya tiene el archivo abierto: se puede desvincular del disco
+        _forget(task_id)
+        Path(path).unlink(missing_ok=True)
+        return response
+
     return send_file(
         path,
         as_attachment=True,
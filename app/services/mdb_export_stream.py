@@ -1,151 +1,278 @@
 # app/services/mdb_export_stream.py
-import csv
 import subprocess
-from collections import defaultdict
-from datetime import datetime, date
+import tempfile
+from contextlib import closing, contextmanager
 from pathlib import Path
-from typing import Dict, List, Tuple
-from openpyxl import Workbook
+from typing import IO, Iterable, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 try:
-    from dateutil import parser as dtparser
-except Exception:
-    dtparser = None
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+MDB_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+PIPE_BUFFER_SIZE = 1 << 20
+USERINFO_COLUMNS = ("userid", "name", "badgenumber", "ssn")
+CHECKTIME_ALIASES = ("checktime", "check_time", "check time")
+CHECKINOUT_COLUMNS = ("userid", *CHECKTIME_ALIASES)
+ACCESS_ODBC_DRIVERS = (
+    "microsoft access driver (*.mdb, *.accdb)",
+    "microsoft access driver (*.mdb)",
+    "mdbtools",
+)
+ODBC_FETCH_SIZE = 10_000
+# "H:MM" para cada minuto del día; las horas viajan como int y se formatean al escribir
+HHMM = np.array([f"{m // 60}:{m % 60:02d}" for m in range(24 * 60)], dtype=object)
+
 
+def _grow_pipe(fd: int) -> None:
+    # En Linux el pipe trae 64 KiB: con más capacidad mdb-export sigue escribiendo
+    # mientras Python parsea, en vez de bloquearse cada 64 KiB.
+    if fcntl is None or not hasattr(fcntl, "F_SETPIPE_SZ"):
+        return
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+    except OSError:
+        pass  # supera /proc/sys/fs/pipe-max-size; se queda con el tamaño por defecto
 
-def mdb_export_to_file(mdb_path: Path, table: str, out_csv: Path) -> None:
+
+@contextmanager
+def mdb_export_pipe(mdb_path: Path, table: str) -> Iterator[IO[bytes]]:
+    """Abre el stdout de mdb-export para `table` como CSV (primera fila = headers).
+
+    El CSV se consume directamente del pipe mientras mdb-export sigue corriendo:
+    sin buffer completo de stdout ni archivo temporal intermedio.
+    """
     cmd = [
         "mdb-export",
         "-D",
-        "%Y-%m-%d %H:%M:%S",
+        MDB_DATETIME_FORMAT,
         "-R",
         "\\n",
         "-d",
         ",",
         "-Q",
+        # columnas binarias (fotos/huellas OLE) fuera del pipe: no se usan
+        "-b",
+        "strip",
         str(mdb_path),
         table,
     ]
-    proc = subprocess.run(cmd, check=True, capture_output=True, text=True)
-    out_csv.write_text(proc.stdout, encoding="utf-8")
+    # stderr a un archivo temporal, no a otro pipe: si mdb-export escribe más avisos que
+    # el buffer del pipe mientras leemos stdout, ambos procesos se bloquearían para siempre
+    with tempfile.TemporaryFile() as errfile:
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=errfile, bufsize=PIPE_BUFFER_SIZE
+        )
+        _grow_pipe(proc.stdout.fileno())
+        try:
+            yield proc.stdout
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+            errfile.seek(0)
+            stderr = errfile.read().decode("utf-8", "replace")
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+
 
+def read_table(mdb_path: Path, table: str, columns: Iterable[str]) -> pd.DataFrame:
+    """Lee solo `columns` de `table` con el parser C de pandas, como texto ya sin espacios.
 
-def parse_dt(s: str) -> datetime:
-    s = s.strip().replace("T", " ")
-    if dtparser:
-        return dtparser.parse(s, dayfirst=False)
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+    Los headers se normalizan a minúsculas sin espacios alrededor; las columnas pedidas
+    que no existan en la tabla simplemente no aparecen en el resultado.
+    """
+    wanted = set(columns)
+    with mdb_export_pipe(mdb_path, table) as stdout:
         try:
-            return datetime.strptime(s, fmt)
-        except ValueError:
-            pass
-    for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M"):
+            df = pd.read_csv(
+                stdout,
+                usecols=lambda c: c.strip().lower() in wanted,
+                # -Q deja los campos sin comillas: una coma en la primera fila de datos
+                # no debe convertir la primera columna en índice y correr las demás
+                index_col=False,
+                dtype=str,
+                keep_default_na=False,
+                encoding="utf-8",
+            )
+        except pd.errors.EmptyDataError:
+            df = pd.DataFrame()
+    df.columns = [c.strip().lower() for c in df.columns]
+    return df.apply(lambda col: col.str.strip())
+
+
+def find_access_driver() -> str | None:
+    """Nombre del driver ODBC de Access instalado, o None (sin pyodbc o sin driver)."""
+    if pyodbc is None:
+        return None
+    drivers = {d.lower(): d for d in pyodbc.drivers()}
+    for name in ACCESS_ODBC_DRIVERS:
+        if name in drivers:
+            return drivers[name]
+    return None
+
+
+def read_odbc_table(conn, table: str, columns: Iterable[str]) -> pd.DataFrame:
+    """Como `read_table`, pero sobre una conexión pyodbc ya abierta.
+
+    CHECKTIME llega como `datetime` desde el driver y se deja tal cual; el resto
+    de columnas se pasa a texto sin espacios, igual que con mdb-export.
+    """
+    wanted = set(columns)
+    cur = conn.cursor()
+    cur.execute(f"SELECT * FROM [{table}] WHERE 1=0")
+    selected = [d[0] for d in cur.description if d[0].strip().lower() in wanted]
+    if not selected:
+        return pd.DataFrame()
+    cur.execute(f"SELECT {', '.join(f'[{c}]' for c in selected)} FROM [{table}]")
+    rows = []
+    while batch := cur.fetchmany(ODBC_FETCH_SIZE):
+        rows.extend(tuple(r) for r in batch)
+    df = pd.DataFrame(rows, columns=[c.strip().lower() for c in selected], dtype=object)
+    for c in df.columns:
+        if c not in CHECKTIME_ALIASES:
+            df[c] = df[c].astype(str).where(df[c].notna(), "").str.strip()
+    return df
+
+
+def read_tables(mdb_path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """USERINFO y CHECKINOUT (columnas normalizadas), con una sola apertura del MDB si se puede.
+
+    Con driver ODBC de Access ambas tablas salen de la misma conexión (un solo parseo
+    del catálogo); si no hay driver, o la conexión o alguna consulta falla, se usa
+    mdb-export.
+    """
+    driver = find_access_driver()
+    if driver:
         try:
-            return datetime.strptime(s, fmt)
-        except ValueError:
-            pass
-    raise ValueError(f"No puedo parsear fecha: {s!r}")
+            conn = pyodbc.connect(f"DRIVER={{{driver}}};DBQ={mdb_path};", autocommit=True)
+            with closing(conn):
+                return (
+                    read_odbc_table(conn, "USERINFO", USERINFO_COLUMNS),
+                    read_odbc_table(conn, "CHECKINOUT", CHECKINOUT_COLUMNS),
+                )
+        except pyodbc.Error:
+            pass  # p. ej. el driver ODBC de MDBTools rechaza la consulta: vamos a mdb-export
+    return (
+        read_table(mdb_path, "USERINFO", USERINFO_COLUMNS),
+        read_table(mdb_path, "CHECKINOUT", CHECKINOUT_COLUMNS),
+    )
 
 
-# ✅ Formato ISO 8601 YYYY-MM-DD
-def fmt_iso(d: date) -> str:
-    return d.strftime("%Y-%m-%d")
+def parse_checktimes(values: Iterable[str]) -> pd.Series:
+    """Parsea todos los CHECKTIME de una vez, sin bucles por fila.
+
+    Camino rápido con el formato fijo pedido a mdb-export (-D). Solo los valores que
+    no encajen pasan por format="mixed", primero mes/día y luego día/mes.
+    """
+    raw = pd.Series(values, dtype=object)
+    dt = pd.to_datetime(raw, format=MDB_DATETIME_FORMAT, errors="coerce", cache=True)
+    for dayfirst in (False, True):
+        bad = dt.isna()
+        if not bad.any():
+            break
+        dt[bad] = pd.to_datetime(
+            raw[bad], format="mixed", dayfirst=dayfirst, errors="coerce"
+        )
+    bad = dt.isna()
+    if bad.any():
+        raise ValueError(f"No puedo parsear fecha: {raw[bad].iloc[0]!r}")
+    return dt
+
+
+def month_mask(ts: np.ndarray, year: int | None, month: int | None) -> np.ndarray:
+    """Máscara de las marcaciones (`datetime64`) que caen en el año/mes pedidos."""
+    if year and month:
+        return ts.astype("datetime64[M]") == np.datetime64(f"{year:04d}-{month:02d}", "M")
+    months = ts.astype("datetime64[M]").astype(np.int64)  # meses desde 1970-01
+    mask = np.ones(len(ts), dtype=bool)
+    if year:
+        mask &= months // 12 == year - 1970
+    if month:
+        mask &= months % 12 == month - 1
+    return mask
+
+
+def group_segments(
+    uid_codes: np.ndarray, days: np.ndarray, minutes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Ordena por (uid, día, minuto) y devuelve `(order, starts, ends)`.
+
+    `order` es la permutación que ordena las marcaciones; `starts`/`ends` son los
+    offsets (sobre el arreglo ya ordenado) de cada grupo consecutivo (uid, día).
+    """
+    order = np.lexsort((minutes, days, uid_codes))
+    u, d = uid_codes[order], days[order]
+    change = np.ones(len(order), dtype=bool)
+    change[1:] = (u[1:] != u[:-1]) | (d[1:] != d[:-1])
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], len(order)) if len(starts) else starts
+    return order, starts, ends
 
 
 def export_mdb_to_csv_stream(
     mdb_path: Path, out_path: Path, *, year: int | None = None, month: int | None = None
 ) -> Path:
-    tmp_dir = out_path.parent
-    users_csv = tmp_dir / "_users.csv"
-    inout_csv = tmp_dir / "_inout.csv"
-
-    # 1) Exporta tablas
-    mdb_export_to_file(mdb_path, "USERINFO", users_csv)
-    mdb_export_to_file(mdb_path, "CHECKINOUT", inout_csv)
-
-    # 2) USERINFO -> mapa con UID -> (Name, Badge, SSN)
-    user_map: Dict[str, Tuple[str, str, str]] = {}
-    with users_csv.open("r", encoding="utf-8", newline="") as f:
-        r = csv.reader(f)
-        headers = next(r, None)
-        idx_uid = idx_name = idx_badge = idx_ssn = None
-        for i, h in enumerate(headers or []):
-            hh = h.strip().lower()
-            if hh == "userid":
-                idx_uid = i
-            if hh == "name":
-                idx_name = i
-            # 👇 corrige el uso de 'in' con tuplas (antes "in ('badgenumber')" evaluaba carácter por carácter)
-            if hh in ("badgenumber"):
-                idx_badge = i
-            if hh in ("ssn"):
-                idx_ssn = i
-        if idx_uid is None or idx_name is None:
-            raise RuntimeError(f"USERINFO: falta USERID/Name, headers={headers}")
-
-        for row in r:
-            if not row:
-                continue
-            uid = str(row[idx_uid]).strip()
-            if not uid:
-                continue
-            name = str(row[idx_name]).strip() if idx_name is not None else ""
-            badge = str(row[idx_badge]).strip() if idx_badge is not None else ""
-            ssn = str(row[idx_ssn]).strip() if idx_ssn is not None else ""
-            user_map[uid] = (name, badge, ssn)
-
-    # 3) CHECKINOUT -> agrupar
-    groups: Dict[Tuple[str, str, str, str, str], List[str]] = defaultdict(list)
-    with inout_csv.open("r", encoding="utf-8", newline="") as f:
-        r = csv.reader(f)
-        headers = next(r, None)
-        idx_uid = idx_ct = None
-        for i, h in enumerate(headers or []):
-            hh = h.strip().lower()
-            if hh == "userid":
-                idx_uid = i
-            if hh in ("checktime", "check_time", "check time"):
-                idx_ct = i
-        if idx_uid is None or idx_ct is None:
-            raise RuntimeError(f"CHECKINOUT: falta USERID/CHECKTIME, headers={headers}")
-
-        for row in r:
-            if not row:
-                continue
-            uid = str(row[idx_uid]).strip()
-            if uid not in user_map:
-                continue
-            dt = parse_dt(str(row[idx_ct]))
-            if year and dt.year != year:
-                continue
-            if month and dt.month != month:
-                continue
-            name, badge, ssn = user_map[uid]
-            # ✅ clave con fecha ISO
-            key = (name, badge, ssn, uid, fmt_iso(dt.date()))
-            groups[key].append(f"{dt.hour}:{dt.minute:02d}")
-
-    # 4) Armar filas
-    def to_min(t: str) -> int:
-        h, m = t.split(":")
-        return int(h) * 60 + int(m)
+    # 1) USERINFO -> UID -> (Name, Badge, SSN)
+    users, inout = read_tables(mdb_path)
+    if "userid" not in users.columns or "name" not in users.columns:
+        raise RuntimeError(f"USERINFO: falta USERID/Name, headers={list(users.columns)}")
+    users = (
+        users[users["userid"] != ""]
+        .drop_duplicates("userid", keep="last")
+        .set_index("userid")
+        .reindex(columns=["name", "badgenumber", "ssn"], fill_value="")
+        .rename(columns={"badgenumber": "badge"})
+    )
 
-    rows = []
-    for (name, badge, ssn, uid, fdate_iso), times in groups.items():
-        times.sort(key=to_min)
-        # ✅ guardamos fecha ya en ISO
-        rows.append([badge, ssn, name, fdate_iso, *times])
+    # 2) CHECKINOUT -> agrupar
+    inout = inout.rename(columns={"check_time": "checktime", "check time": "checktime"})
+    if "userid" not in inout.columns or "checktime" not in inout.columns:
+        raise RuntimeError(
+            f"CHECKINOUT: falta USERID/CHECKTIME, headers={list(inout.columns)}"
+        )
+
+    inout = inout[inout["userid"].isin(users.index)]
+    ts = parse_checktimes(inout["checktime"]).to_numpy(dtype="datetime64[s]")
+    mask = month_mask(ts, year, month)
+    ts = ts[mask]
+    inout = inout[mask]
+
+    # 3) Agrupar por (uid, día) sobre enteros: un lexsort y los offsets de cada grupo
+    days, secs = np.divmod(ts.view(np.int64), 86400)  # segundos Unix
+    minutes = secs // 60
+    uid_codes, uid_values = pd.factorize(inout["userid"])
+    order, starts, ends = group_segments(uid_codes, days, minutes)
+    minutes = minutes[order]
 
-    # Ordenar por Name y luego Fecha (ISO ordena bien lexicográficamente, pero hacemos seguro)
-    def row_key(r):
-        name, d = r[2], r[3]  # [badge, ssn, name, date_iso, ...]
-        y, m, d_ = d.split("-")
-        return (name.upper(), int(y), int(m), int(d_))
+    first = order[starts]
+    group_uid = uid_codes[first]
+    # ✅ fecha ISO (YYYY-MM-DD), formateada una vez por día distinto: todos los grupos de
+    # un mismo día comparten el mismo objeto str, igual que Name/Badge/SSN por usuario
+    unique_days, day_idx = np.unique(days[first], return_inverse=True)
+    day_iso = np.datetime_as_string(unique_days.astype("datetime64[D]")).astype(object)
+    group_date = day_iso[day_idx]
+    info = users.reindex(uid_values)
+    names, badges, ssns = (info[c].to_numpy() for c in ("name", "badge", "ssn"))
+    grouped = [
+        ((names[c], badges[c], ssns[c], uid_values[c], d), minutes[s:e])
+        for c, d, s, e in zip(group_uid, group_date, starts, ends)
+    ]
 
-    rows.sort(key=row_key)
+    # Ordenar por Name y luego Fecha (la fecha ISO ya ordena bien lexicográficamente)
+    ordered = sorted(grouped, key=lambda kv: (kv[0][0].upper(), kv[0][4]))
 
-    # 5) Escribir Excel con nuevas columnas
-    max_hours = max((len(r) - 4 for r in rows), default=0)
+    # 4) Escribir Excel con nuevas columnas
+    max_hours = int((ends - starts).max()) if len(starts) else 0
     headers_out = [
         "Codigo (Badgenumber)",
         "Cedula (SSN)",
@@ -153,20 +280,26 @@ def export_mdb_to_csv_stream(
         "Fecha (YYYY-MM-DD)",
     ] + [f"Hora{i}" for i in range(1, max_hours + 1)]
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Asistencias"
-
-    # escribir encabezados
-    ws.append(headers_out)
-
-    # escribir filas
-    for r in rows:
-        ws.append(r + [""] * (len(headers_out) - len(r)))
-
     # forzar extensión .xlsx
     if out_path.suffix.lower() != ".xlsx":
         out_path = out_path.with_suffix(".xlsx")
 
-    wb.save(out_path)
+    # constant_memory: cada fila se escribe a disco al pasar a la siguiente y se libera
+    wb = xlsxwriter.Workbook(
+        str(out_path),
+        {"constant_memory": True, "use_zip64": True, "strings_to_urls": False},
+    )
+    ws = wb.add_worksheet("Asistencias")
+
+    # escribir encabezados
+    ws.write_row(0, 0, headers_out)
+
+    # escribir filas (se generan al vuelo, sin materializar la lista completa);
+    # lookups de métodos/globales ligados a locales: es el único bucle por grupo
+    write_row = ws.write_row
+    hhmm = HHMM
+    for i, ((name, badge, ssn, _uid, fdate_iso), times) in enumerate(ordered, 1):
+        write_row(i, 0, [badge, ssn, name, fdate_iso, *hhmm[times]])
+
+    wb.close()
     return out_path
@@ -0,0 +1,157 @@
+import io
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+from openpyxl import load_workbook
+
+from app.services import mdb_export_stream
+
+TABLES = {
+    "USERINFO": (
+        "USERID,Badgenumber,SSN,Name,Gender\n"
+        # -Q: la coma del nombre llega sin comillas y sobra un campo en la primera fila
+        "3,103,0911111111,Perez, Juan,M\n"
+        "1,101,0912345678,Zoila ,F\n"
+        "2,102,0987654321,ana,F\n"
+    ),
+    "CHECKINOUT": (
+        "USERID,CHECKTIME,CHECKTYPE\n"
+        "1,2024-05-02 17:05:00,O\n"
+        "1,2024-05-02 08:01:00,I\n"
+        "2,2024-05-03 09:30:00,I\n"
+        "2,2024-05-01 07:59:00,I\n"
+        "2,2024-04-30 08:00:00,I\n"
+        "9,2024-05-01 08:00:00,I\n"
+        "3,2024-05-04 08:15:00,I\n"
+    ),
+}
+
+
+@contextmanager
+def fake_mdb_export_pipe(mdb_path, table):
+    yield io.BytesIO(TABLES[table].encode("utf-8"))
+
+
+def read_rows(path):
+    ws = load_workbook(path).active
+    return ws.title, [
+        [c if c is not None else "" for c in r] for r in ws.iter_rows(values_only=True)
+    ]
+
+
+def test_export_groups_and_sorts_month(tmp_path, monkeypatch):
+    monkeypatch.setattr(mdb_export_stream, "pyodbc", None)
+    monkeypatch.setattr(mdb_export_stream, "mdb_export_pipe", fake_mdb_export_pipe)
+
+    out = mdb_export_stream.export_mdb_to_csv_stream(
+        tmp_path / "db.mdb", tmp_path / "out.xlsx", year=2024, month=5
+    )
+
+    title, rows = read_rows(out)
+    assert title == "Asistencias"
+    assert rows[0] == [
+        "Codigo (Badgenumber)",
+        "Cedula (SSN)",
+        "Nombre",
+        "Fecha (YYYY-MM-DD)",
+        "Hora1",
+        "Hora2",
+    ]
+    assert rows[1:] == [
+        ["102", "0987654321", "ana", "2024-05-01", "7:59", ""],
+        ["102", "0987654321", "ana", "2024-05-03", "9:30", ""],
+        ["103", "0911111111", "Perez", "2024-05-04", "8:15", ""],
+        ["101", "0912345678", "Zoila", "2024-05-02", "8:01", "17:05"],
+    ]
+
+
+class FakePyodbc:
+    """pyodbc mínimo sobre sqlite3: misma API DB-API (cursor/description/fetchmany)."""
+
+    Error = sqlite3.Error
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connects = 0
+
+    def drivers(self):
+        return ["MDBTools"]
+
+    def connect(self, conn_str, autocommit=False):
+        self.connects += 1
+        return self.conn
+
+
+def test_export_reads_both_tables_over_one_odbc_connection(tmp_path, monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE USERINFO (USERID INTEGER, Name TEXT, SSN TEXT)")
+    conn.execute("CREATE TABLE CHECKINOUT (USERID INTEGER, CHECKTIME TEXT)")
+    conn.execute("INSERT INTO USERINFO VALUES (7, ' Ana ', NULL)")
+    conn.executemany(
+        "INSERT INTO CHECKINOUT VALUES (?, ?)",
+        [(7, "2024-05-01 17:00:00"), (7, "2024-05-01 08:00:00"), (8, "2024-05-01 08:00:00")],
+    )
+    fake = FakePyodbc(conn)
+    monkeypatch.setattr(mdb_export_stream, "pyodbc", fake)
+
+    out = mdb_export_stream.export_mdb_to_csv_stream(
+        tmp_path / "db.mdb", tmp_path / "out.xlsx", year=2024, month=5
+    )
+
+    assert fake.connects == 1
+    assert read_rows(out)[1][1:] == [["", "", "Ana", "2024-05-01", "8:00", "17:00"]]
+
+
+def test_export_falls_back_to_mdb_export_when_odbc_query_fails(tmp_path, monkeypatch):
+    # conexión sin tablas: el primer execute lanza sqlite3.OperationalError (pyodbc.Error)
+    fake = FakePyodbc(sqlite3.connect(":memory:"))
+    monkeypatch.setattr(mdb_export_stream, "pyodbc", fake)
+    monkeypatch.setattr(mdb_export_stream, "mdb_export_pipe", fake_mdb_export_pipe)
+
+    out = mdb_export_stream.export_mdb_to_csv_stream(
+        tmp_path / "db.mdb", tmp_path / "out.xlsx", year=2024, month=5
+    )
+
+    assert fake.connects == 1
+    assert [r[2] for r in read_rows(out)[1][1:]] == ["ana", "ana", "Perez", "Zoila"]
+
+
+def test_parse_checktimes_falls_back_for_other_formats():
+    dt = mdb_export_stream.parse_checktimes(
+        ["2024-05-01 08:00:00", "2024-05-01T08:01", "05/02/2024 09:00", "25/12/2024 10:00"]
+    )
+    assert dt.dt.strftime("%Y-%m-%d %H:%M").tolist() == [
+        "2024-05-01 08:00",
+        "2024-05-01 08:01",
+        "2024-05-02 09:00",
+        "2024-12-25 10:00",
+    ]
+
+
+def test_group_segments_sorts_by_user_day_minute():
+    order, starts, ends = mdb_export_stream.group_segments(
+        np.array([1, 0, 1, 0]), np.array([5, 5, 5, 6]), np.array([3, 1, 2, 0])
+    )
+    assert order.tolist() == [1, 3, 2, 0]
+    assert starts.tolist() == [0, 1, 2]
+    assert ends.tolist() == [1, 2, 4]
+
+
+def test_pipe_survives_large_stderr(tmp_path, monkeypatch):
+    # más avisos que el buffer de un pipe: no debe colgarse esperando stdout/stderr
+    fake = tmp_path / "mdb-export"
+    fake.write_text(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        "sys.stderr.write('w' * 200_000)\n"
+        "print('USERID,Name\\n1,Ana')\n"
+    )
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+
+    df = mdb_export_stream.read_table(tmp_path / "db.mdb", "USERINFO", ("userid", "name"))
+
+    assert df.to_dict("records") == [{"userid": "1", "name": "Ana"}]
@@ -0,0 +1,82 @@
+import gc
+import io
+from collections import deque
+from threading import BoundedSemaphore, Event
+
+from app import create_app
+from app import routes
+
+
+def test_download_sends_file_once_and_forgets_task(tmp_path):
+    xlsx = tmp_path / "out.xlsx"
+    xlsx.write_bytes(b"xlsx")
+    routes.TASK_OUTPUTS["t1"] = xlsx
+
+    client = create_app().test_client()
+    r = client.get("/download/t1")
+    assert r.status_code == 200
+    assert r.data == b"xlsx"
+    r.close()
+
+    assert "t1" not in routes.TASK_OUTPUTS
+    assert not xlsx.exists()
+    assert client.get("/download/t1").status_code == 404
+
+
+def test_ttl_cache_evicts_oldest_and_expired(monkeypatch):
+    cache = routes.TTLCache(maxsize=2, ttl=10)
+    clock = [0.0]
+    monkeypatch.setattr(routes, "monotonic", lambda: clock[0])
+
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.get("a")
+    cache["c"] = 3
+    assert "b" not in cache
+    assert cache.get("a") == 1
+
+    clock[0] = 11.0
+    assert "a" not in cache
+    assert len(cache) == 0
+
+
+def test_events_streams_until_done():
+    routes.EVENT_QUEUES["t2"] = (deque(), Event())
+    routes._emit("t2", "hola")
+    routes._emit("t2", "DONE")
+
+    r = create_app().test_client().get("/events/t2")
+    body = r.get_data(as_text=True)
+    assert "event: message\ndata: hola\n\n" in body
+    assert body.endswith("event: done\ndata: done\n\n")
+
+
+def test_upload_rejected_when_no_export_slots(monkeypatch):
+    monkeypatch.setattr(routes, "EXPORT_SLOTS", BoundedSemaphore(1))
+    routes.EXPORT_SLOTS.acquire()
+
+    r = create_app().test_client().post(
+        "/upload",
+        data={"file": (io.BytesIO(b"mdb"), "reloj.mdb"), "year": "2020", "month": "1"},
+        content_type="multipart/form-data",
+    )
+    assert r.status_code == 429
+    assert r.get_json()["ok"] is False
+
+
+def test_save_upload_copies_stream_in_chunks(tmp_path):
+    from werkzeug.datastructures import FileStorage
+
+    data = bytes(range(256)) * 100
+    dst = tmp_path / "reloj.mdb"
+    routes.save_upload(FileStorage(io.BytesIO(data), "reloj.mdb"), dst, chunk_size=1000)
+    assert dst.read_bytes() == data
+
+
+def test_gc_paused_nests_across_exports():
+    assert gc.isenabled()
+    with routes.gc_paused():
+        with routes.gc_paused():
+            assert not gc.isenabled()
+        assert not gc.isenabled()
+    assert gc.isenabled()
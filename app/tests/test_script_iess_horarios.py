@@ -0,0 +1,111 @@
+import importlib.util
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+SCRIPT = Path(__file__).resolve().parents[2] / "scripts" / "scriptIESSHorarios.py"
+_spec = importlib.util.spec_from_file_location("scriptIESSHorarios", SCRIPT)
+script = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(script)
+
+# USERID 9 no existe en USERINFO; 3 ("ana") aparece antes que 2 ("Ana") y gana el empate
+CHECKINOUT = pd.DataFrame({
+    "USERID": [3, 2, 1, 1, 9, 4, 1, 2, 3],
+    "CHECKTIME": pd.to_datetime([
+        "2024-05-02 18:00:00",
+        "2024-05-02 17:05:00",
+        "2024-05-02 08:01:00",
+        "2024-05-02 12:00:00",
+        "2024-05-02 08:00:00",
+        "2024-05-01 09:30:00",
+        "2024-05-03 08:00:00",
+        "2024-05-02 07:00:00",
+        "2024-05-02 07:59:30",
+    ]),
+})
+CASES = {
+    "plain": (
+        ["zoila", "Ana", "ana", "Bob"],
+        b"Nombre,Fecha,Hora1,Hora2\r\n"
+        b"ana,5/2/24,7:59,18:00\r\n"
+        b"Ana,5/2/24,7:00,17:05\r\n"
+        b"Bob,5/1/24,9:30,\r\n"
+        b"zoila,5/2/24,8:01,12:00\r\n"
+        b"zoila,5/3/24,8:00,\r\n",
+    ),
+    "quoted": (
+        ["Perez, Juan", 'O"Brien', "ana", "Bob"],
+        b"Nombre,Fecha,Hora1,Hora2\r\n"
+        b"ana,5/2/24,7:59,18:00\r\n"
+        b"Bob,5/1/24,9:30,\r\n"
+        b'"O""Brien",5/2/24,7:00,17:05\r\n'
+        b'"Perez, Juan",5/2/24,8:01,12:00\r\n'
+        b'"Perez, Juan",5/3/24,8:00,\r\n',
+    ),
+}
+
+
+def frames(names):
+    return pd.DataFrame({"USERID": [1, 2, 3, 4], "Name": names}), CHECKINOUT.copy()
+
+
+@pytest.fixture(params=["to_csv", "pyarrow", "duckdb"])
+def export(request, monkeypatch):
+    """Cada motor de salida del script, con la misma firma (users, inout, out_path)."""
+    if request.param == "duckdb":
+        if script.duckdb is None:
+            pytest.skip("duckdb no instalado")
+        return script.export_with_duckdb
+    if request.param == "pyarrow":
+        if script.pa_csv is None:
+            pytest.skip("pyarrow no instalado")
+    else:
+        monkeypatch.setattr(script, "pa_csv", None)
+
+    def run(users_df, inout_df, out_path):
+        rows, max_hours = script.build_rows(users_df, inout_df)
+        script.write_csv(rows, out_path, max_hours)
+
+    return run
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_exports_match_expected_csv(export, case, tmp_path):
+    names, expected = CASES[case]
+    out = tmp_path / "out.csv"
+
+    export(*frames(names), out)
+
+    assert out.read_bytes() == expected
+
+
+def test_empty_checktime_raises(export, tmp_path):
+    users, inout = frames(["zoila", "Ana", "ana", "Bob"])
+    inout.loc[0, "CHECKTIME"] = pd.NaT
+
+    with pytest.raises(ValueError, match="No puedo parsear CHECKTIME"):
+        export(users, inout, tmp_path / "out.csv")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2024-05-01 08:00:00", datetime(2024, 5, 1, 8, 0)),
+        ("2024-05-01T08:01", datetime(2024, 5, 1, 8, 1)),
+        ("05/02/2024 09:00", datetime(2024, 5, 2, 9, 0)),
+        ("25/12/2024 10:00", datetime(2024, 12, 25, 10, 0)),
+        ("1/2/24 7:05", datetime(2024, 1, 2, 7, 5)),
+        ("12/31/69 23:59:59", datetime(1969, 12, 31, 23, 59, 59)),
+        ("01/02/2024 05:00 PM", datetime(2024, 1, 2, 17, 0)),
+        ("01/02/2024 12:30 am", datetime(2024, 1, 2, 0, 30)),
+    ],
+)
+def test_parse_dt_formats(value, expected):
+    assert script.parse_dt(value) == expected
+
+
+def test_parse_dt_rejects_garbage():
+    with pytest.raises(ValueError, match="No puedo parsear CHECKTIME"):
+        script.parse_dt("garbage")
@@ -12,17 +12,34 @@ Dependencias:
       * Instalar "Microsoft Access Database Engine 2016 Redistributable"
     - Opción Mac/Linux: mdbtools (brew install mdbtools / apt-get install mdbtools)
       * pip install pandas
+    - Opcionales: pyarrow (escritura del CSV) y duckdb (agrupado y CSV en un solo paso)
 """
 
-import csv
+import functools
+import re
 import sys
 import subprocess
-from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow es opcional: sin él se escribe con DataFrame.to_csv
+    pa = pa_csv = None
+
+try:
+    import duckdb
+except ImportError:  # duckdb es opcional: sin él se usa build_rows + write_csv
+    duckdb = None
+
+ODBC_BATCH_SIZE = 10_000
+# Formato que se le pide a mdb-export para CHECKTIME (-D)
+MDB_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 def find_access_driver():
     """Intenta detectar un driver ODBC de Access disponible (Windows o MDBTools ODBC)."""
     try:
@@ -49,120 +66,266 @@ def read_with_pyodbc(mdb_path):
     # Conexión ODBC. Para MDBTools ODBC en Mac/Linux, el nombre puede requerir DSN previo.
     conn_str = f"DRIVER={{{driver}}};DBQ={mdb_path};"
     with pyodbc.connect(conn_str, autocommit=True) as conn:
-        users = pd.read_sql("SELECT USERID, Name FROM USERINFO", conn)
-        inout = pd.read_sql("SELECT USERID, CHECKTIME FROM CHECKINOUT", conn)
+        users = read_sql_columns(
+            conn, "SELECT USERID, Name FROM USERINFO", {"USERID": "int64", "Name": object}
+        )
+        inout = read_sql_columns(
+            conn,
+            # INNER JOIN: las marcaciones sin usuario ni siquiera salen de la base.
+            # Orden desde la base (usa sus índices): build_rows ya no necesita reordenar
+            "SELECT c.USERID, c.CHECKTIME FROM CHECKINOUT c"
+            " INNER JOIN USERINFO u ON c.USERID = u.USERID"
+            " ORDER BY c.USERID, c.CHECKTIME",
+            {"USERID": "int64", "CHECKTIME": "datetime64[s]"},
+        )
     return users, inout
 
+def _to_array(values, dtype):
+    """Lote de una columna como array numpy tipado; object si el driver trae NULL/texto."""
+    # Hay que mirarlo antes: datetime64 convierte None en NaT sin avisar
+    if None in values:
+        return np.asarray(values, dtype=object)
+    try:
+        return np.asarray(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return np.asarray(values, dtype=object)
+
+def read_sql_columns(conn, sql, dtypes):
+    """Ejecuta `sql` y arma el DataFrame por lotes de fetchmany, sin pd.read_sql.
+
+    `dtypes` mapea cada columna del SELECT (en orden) a su dtype numpy. Cada lote se
+    convierte enseguida a arrays tipados: en memoria solo conviven esos arrays y un lote
+    de filas, en vez de todas las filas como objetos Python antes del DataFrame."""
+    cur = conn.cursor()
+    cur.arraysize = ODBC_BATCH_SIZE
+    cur.execute(sql)
+    chunks = {name: [] for name in dtypes}
+    while True:
+        batch = cur.fetchmany(ODBC_BATCH_SIZE)
+        if not batch:
+            break
+        for (name, dtype), values in zip(dtypes.items(), zip(*batch)):
+            chunks[name].append(_to_array(values, dtype))
+    return pd.DataFrame({
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[name])
+        for name, parts in chunks.items()
+    })
+
 def read_with_mdbtools(mdb_path):
-    """Lee tablas con mdb-export (sin ODBC)."""
-    def export_table(table):
-        cmd = ["mdb-export", "-D", "%Y-%m-%d %H:%M:%S", str(mdb_path), table]
-        out = subprocess.check_output(cmd, text=True)
-        # mdb-export produce CSV
-        from io import StringIO
-        return pd.read_csv(StringIO(out))
-    users = export_table("USERINFO")
-    inout = export_table("CHECKINOUT")
-    # Normalizar nombres de columnas por si vienen con mayúsculas/espacios
-    users.columns = [c.strip() for c in users.columns]
-    inout.columns = [c.strip() for c in inout.columns]
-    return users[["USERID", "Name"]], inout[["USERID", "CHECKTIME"]]
+    """Lee tablas con mdb-export (sin ODBC), parseando el CSV directo desde el pipe."""
+    def export_table(table, columns, **read_csv_kwargs):
+        cmd = ["mdb-export", "-D", MDB_DATETIME_FORMAT, str(mdb_path), table]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+        try:
+            # pandas lee el pipe a medida que mdb-export escribe: sin copiar todo stdout
+            df = pd.read_csv(
+                proc.stdout, usecols=lambda c: c.strip() in columns, **read_csv_kwargs
+            )
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        # Normalizar nombres de columnas por si vienen con espacios
+        df.columns = [c.strip() for c in df.columns]
+        return df
+    users = export_table("USERINFO", {"USERID", "Name"}, dtype={"USERID": "int64"})
+    inout = export_table(
+        "CHECKINOUT", {"USERID", "CHECKTIME"}, dtype={"USERID": "int64", "CHECKTIME": str}
+    )
+    # Equivale al INNER JOIN de pyodbc: las marcaciones huérfanas se descartan antes de parsear
+    inout = inout.loc[inout["USERID"].isin(users["USERID"]), ["USERID", "CHECKTIME"]]
+    try:
+        checktime = pd.to_datetime(inout["CHECKTIME"], format=MDB_DATETIME_FORMAT)
+        inout = inout.assign(CHECKTIME=checktime)
+    except ValueError:
+        pass  # formato inesperado: build_rows lo resuelve con parse_checktime_series
+    return users[["USERID", "Name"]], inout
+
+_DT_RE = re.compile(
+    r"(\d{1,4})[-/](\d{1,2})[-/](\d{1,4})[ T](\d{1,2}):(\d{2})(?::(\d{2}))?"
+    r"(?:\s*([AaPp])[Mm])?"
+)
+
+def _year(s):
+    """Año de 2 dígitos como %y (69-99 -> 19xx, 00-68 -> 20xx); 4 dígitos tal cual."""
+    y = int(s)
+    if len(s) <= 2:
+        y += 1900 if y >= 69 else 2000
+    return y
 
 def parse_dt(value):
     """Convierte CHECKTIME a datetime (soporta segundos y varios formatos)."""
     if isinstance(value, datetime):
         return value
+    return _parse_dt_str(str(value).strip())
 
-    s = str(value).strip().replace("T", " ")
-    # Intentos comunes (con y sin segundos, Y-m-d y m/d/Y y d/m/Y)
-    formats = [
-        "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
-        "%m/%d/%y %H:%M:%S",  "%m/%d/%y %H:%M",
-        "%m/%d/%Y %H:%M:%S",  "%m/%d/%Y %H:%M",
-        "%d/%m/%y %H:%M:%S",  "%d/%m/%y %H:%M",
-        "%d/%m/%Y %H:%M:%S",  "%d/%m/%Y %H:%M",
-        # Por si hubiera AM/PM (no suele pasar, pero no estorba)
-        "%m/%d/%y %I:%M:%S %p", "%m/%d/%y %I:%M %p",
-        "%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y %I:%M %p",
-    ]
-    for fmt in formats:
-        try:
-            return datetime.strptime(s, fmt)
-        except ValueError:
-            pass
+@functools.lru_cache(maxsize=1 << 20)
+def _parse_dt_str(s):
+    """parse_dt para texto; memoizado porque los relojes repiten mucho el mismo CHECKTIME."""
+    # Un solo match en vez de probar formatos con strptime (cada fallo es una excepción):
+    # Y-m-d, o m/d/Y con d/m/Y de respaldo; año de 2 o 4 dígitos, segundos y AM/PM opcionales
+    m = _DT_RE.fullmatch(s)
+    if m:
+        a, b, c, hh, mm, ss, ampm = m.groups()
+        hour = int(hh)
+        if ampm:
+            hour = hour % 12 + (12 if ampm in "pP" else 0)
+        if len(a) == 4:
+            candidates = [(int(a), int(b), int(c))]
+        else:
+            year = _year(c)
+            candidates = [(year, int(a), int(b)), (year, int(b), int(a))]
+        for y, mo, d in candidates:
+            try:
+                return datetime(y, mo, d, hour, int(mm), int(ss or 0))
+            except ValueError:
+                pass
 
     # Último recurso: usar pandas.to_datetime, primero asumiendo month/day
     dt = pd.to_datetime(s, errors="coerce", dayfirst=False)
     if pd.isna(dt):
         dt = pd.to_datetime(s, errors="coerce", dayfirst=True)
     if pd.isna(dt):
-        raise ValueError(f"No puedo parsear CHECKTIME: {value!r}")
+        raise ValueError(f"No puedo parsear CHECKTIME: {s!r}")
     return dt.to_pydatetime()
 
-def fmt_date(dt):
-    """Formatea fecha como M/D/YY (sin ceros a la izquierda, estilo de tu ejemplo)."""
-    y = dt.strftime("%y")
-    m = str(int(dt.strftime("%m")))
-    d = str(int(dt.strftime("%d")))
-    return f"{m}/{d}/{y}"
+def parse_checktime_series(values):
+    """Convierte toda la columna CHECKTIME a datetime64 de una vez.
 
-def fmt_time(dt):
-    """Formatea hora como H:MM (24h, sin cero a la izquierda en la hora)."""
-    h = str(int(dt.strftime("%H")))
-    mm = dt.strftime("%M")
-    return f"{h}:{mm}"
+    Primero asume month/day y luego day/month solo para lo que quedó en NaT;
+    lo que ni así se entienda pasa por parse_dt (que lanza el error claro). Un CHECKTIME
+    vacío o NULL (NaN/NaT, p. ej. ya convertido por el lector) también es un error."""
+    dt = pd.to_datetime(values, errors="coerce", format="mixed", dayfirst=False)
+    bad = dt.isna()
+    if bad.any():
+        dt[bad] = pd.to_datetime(values[bad], errors="coerce", format="mixed", dayfirst=True)
+        bad = dt.isna()
+        if bad.any():
+            dt[bad] = [parse_dt(v) for v in values[bad]]
+            # parse_dt devuelve NaT tal cual (NaT es un datetime): sin fecha no hay grupo
+            bad = dt.isna()
+            if bad.any():
+                raise ValueError(f"No puedo parsear CHECKTIME: {values[bad].iloc[0]!r}")
+    return dt
 
 def build_rows(users_df, inout_df):
-    # Asegurar tipos correctos
-    users_df["USERID"] = users_df["USERID"].astype(str)
-    inout_df["USERID"] = inout_df["USERID"].astype(str)
+    # Asegurar tipos correctos: USERID entero (los lectores ya lo traen como int64)
+    users_df["USERID"] = users_df["USERID"].astype("int64", copy=False)
+    inout_df["USERID"] = inout_df["USERID"].astype("int64", copy=False)
 
-    # Diccionario USERID -> Name
-    user_map = dict(zip(users_df["USERID"], users_df["Name"]))
+    # Diccionario USERID -> Name (claves int: hash inmediato, sin crear N strings)
+    user_map = dict(zip(users_df["USERID"].to_numpy(), users_df["Name"].to_numpy()))
+    # Clave de orden sin mayúsculas/minúsculas: un upper() por usuario, no por fila
+    upper_map = dict(zip(users_df["USERID"].to_numpy(), users_df["Name"].str.upper().to_numpy()))
 
-    # Grupo (USERID, date_str) -> lista de times_str
-    grouped = defaultdict(list)
+    # Solo marcaciones de usuarios conocidos; fecha/minutos en una sola pasada vectorizada
+    inout_df = inout_df[inout_df["USERID"].isin(user_map)].copy()
+    dt = parse_checktime_series(inout_df["CHECKTIME"])
+    inout_df["date_key"] = dt.dt.normalize()
+    inout_df["minutes"] = dt.dt.hour * 60 + dt.dt.minute
+    # Fecha M/D/YY y hora H:MM (sin ceros a la izquierda) formateadas por columna
+    m = dt.dt.month.astype(str)
+    d = dt.dt.day.astype(str)
+    y = (dt.dt.year % 100).astype(str).str.zfill(2)
+    inout_df["date_str"] = m.str.cat([d, y], sep="/")
+    inout_df["time_str"] = dt.dt.hour.astype(str).str.cat(
+        dt.dt.minute.astype(str).str.zfill(2), sep=":"
+    )
+    # Grupo (USERID, día) numerado por orden de aparición, y dentro de él por hora:minuto;
+    # ambos caben en una sola clave entera (minutos < 1440), así basta un argsort
+    inout_df["group"] = inout_df.groupby(["USERID", "date_key"], sort=False).ngroup()
+    group = inout_df["group"].to_numpy(dtype=np.int64)
+    sort_key = group * 1440 + inout_df["minutes"].to_numpy()
+    # Si las filas ya llegan ordenadas (ORDER BY en ODBC) basta verificarlo en O(N)
+    if (np.diff(sort_key) < 0).any():
+        inout_df = inout_df.iloc[np.argsort(sort_key, kind="stable")]
 
-    for _, row in inout_df.iterrows():
-        uid = row["USERID"]
-        if uid not in user_map:
-            continue
-        dt = parse_dt(row["CHECKTIME"])
-        date_str = fmt_date(dt)
-        time_str = fmt_time(dt)
-        grouped[(uid, date_str)].append(time_str)
+    # Ya ordenado, cada grupo (0..G-1) es un tramo contiguo: sus límites salen de contar
+    # las marcaciones por grupo, sin groupby ni una llamada Python por grupo para agregar
+    counts = np.bincount(group)
+    # Ancho de la fila más larga, ya conocido al agrupar: write_csv no recorre las filas
+    max_hours = int(counts.max()) if len(counts) else 0
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    first = inout_df.iloc[starts]
+    grouped = pd.DataFrame({
+        "USERID": first["USERID"].to_numpy(),
+        "date_key": first["date_key"].to_numpy(),
+        "date_str": first["date_str"].to_numpy(),
+    })
+    time_str = inout_df["time_str"].to_numpy()
+    grouped["Name"] = grouped["USERID"].map(user_map)
+    grouped["name_key"] = grouped["USERID"].map(upper_map)
+
+    # ---- Ordenar por Nombre y Fecha ----
+    # con el datetime64 del día (date_key), sin volver a parsear el texto M/D/YY
+    grouped = grouped.sort_values(["name_key", "date_key"], kind="stable")
 
     # Construir filas finales: [Nombre, Fecha, Hora1..]
-    rows = []
-    for (uid, date_str), times in grouped.items():
-        # Ordenar por hora:minuto
-        def to_minutes(t):
-            h, m = t.split(":")
-            return int(h) * 60 + int(m)
-        times_sorted = sorted(times, key=to_minutes)
-        rows.append([user_map[uid], date_str, *times_sorted])
+    rows = [
+        [name, date_str, *time_str[starts[i]:ends[i]]]
+        for i, name, date_str in zip(grouped.index, grouped["Name"], grouped["date_str"])
+    ]
+    return rows, max_hours
 
-    # ---- Ordenar por Nombre y Fecha ----
-    def parse_date_key(d):
-        # M/D/YY -> datetime
-        m, d, y = d.split("/")
-        y = "20" + y if len(y) == 2 else y
-        return datetime(int(y), int(m), int(d))
-
-    rows.sort(key=lambda r: (r[0].upper(), parse_date_key(r[1])))
-    return rows
-
-def write_csv(rows, out_path):
-    headers = ["Nombre", "Fecha"]
-    max_hours = max((len(r) - 2 for r in rows), default=0)
-    headers += [f"Hora{i}" for i in range(1, max_hours + 1)]
-
-    with open(out_path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(headers)
-        for r in rows:
-            filled = r + [""] * (len(headers) - len(r))
-            w.writerow(filled)
+def write_csv(rows, out_path, max_hours):
+    # Columnas dimensionadas de antemano; DataFrame rellena con vacíos las filas más cortas
+    header = ["Nombre", "Fecha"] + [f"Hora{i}" for i in range(1, max_hours + 1)]
+    df = pd.DataFrame(rows, columns=header)
+    # pyarrow serializa la tabla en C. Se escribe sin comillas para que el archivo quede
+    # idéntico al de to_csv, así que solo se usa si ningún nombre las necesita
+    # (fechas y horas nunca llevan comas ni comillas)
+    if pa_csv is not None and not df["Nombre"].str.contains(r'[,"\r\n]', na=False).any():
+        options = pa_csv.WriteOptions(eol="\r\n", quoting_style="none", quoting_header="none")
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), str(out_path), options)
+        return
+    # lineterminator igual al de csv.writer para no cambiar el archivo generado
+    df.to_csv(out_path, index=False, encoding="utf-8", na_rep="", lineterminator="\r\n")
+
+def export_with_duckdb(users_df, inout_df, out_path):
+    """Agrupa, ordena y escribe el CSV dentro de DuckDB, sin pasar las filas por Python.
+
+    Mismo resultado que build_rows + write_csv: `pos` (orden de llegada) desempata igual
+    que el orden estable de pandas, tanto las horas de un día como los grupos."""
+    # Igual que user_map en build_rows: USERID entero, y si se repite gana el último
+    users = pd.DataFrame({
+        "USERID": users_df["USERID"].astype("int64", copy=False).to_numpy(),
+        "Name": users_df["Name"].to_numpy(),
+    }).drop_duplicates("USERID", keep="last")
+    # Solo se parsean las marcaciones de usuarios conocidos
+    inout = inout_df[inout_df["USERID"].astype("int64", copy=False).isin(users["USERID"])]
+    inout = pd.DataFrame({
+        "USERID": inout["USERID"].astype("int64", copy=False).to_numpy(),
+        "CHECKTIME": parse_checktime_series(inout["CHECKTIME"]).to_numpy(),
+        "pos": np.arange(len(inout)),
+    })
+
+    con = duckdb.connect()
+    con.register("u", users)
+    con.register("ci", inout)
+    con.execute("""
+        CREATE TEMP TABLE g AS
+        SELECT u.Name AS name,
+               CAST(ci.CHECKTIME AS DATE) AS day,
+               min(ci.pos) AS first_pos,
+               list(strftime(CAST(ci.CHECKTIME AS TIMESTAMP), '%-H:%M')
+                    ORDER BY hour(ci.CHECKTIME) * 60 + minute(ci.CHECKTIME), ci.pos) AS times
+        FROM ci JOIN u USING (USERID)
+        GROUP BY ci.USERID, u.Name, day
+    """)
+    max_hours = con.execute("SELECT coalesce(max(len(times)), 0) FROM g").fetchone()[0]
+    horas = "".join(f", times[{i}] AS Hora{i}" for i in range(1, max_hours + 1))
+    # NULLIF: DuckDB escribe "" para texto vacío; csv.writer/to_csv dejan la celda vacía
+    target = str(out_path).replace("'", "''")
+    con.execute(f"""
+        COPY (
+            SELECT NULLIF(name, '') AS Nombre, strftime(day, '%-m/%-d/%y') AS Fecha{horas}
+            FROM g
+            ORDER BY upper(name), day, first_pos
+        ) TO '{target}' (HEADER, DELIMITER ',', NEW_LINE '\\r\\n')
+    """)
+    con.close()
 
 def main():
     if len(sys.argv) < 3:
@@ -189,8 +352,11 @@ def main():
             print(f"Intento mdbtools falló: {e2}")
             sys.exit(1)
 
-    rows = build_rows(users_df, inout_df)
-    write_csv(rows, out_path)
+    if duckdb is not None:
+        export_with_duckdb(users_df, inout_df, out_path)
+    else:
+        rows, max_hours = build_rows(users_df, inout_df)
+        write_csv(rows, out_path, max_hours)
     print(f"Listo. CSV generado en: {out_path}")
 
 if __name__ == "__main__":